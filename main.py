@@ -14,6 +14,12 @@ from telethon import TelegramClient, events
 from telethon.sessions import StringSession
 from telethon.tl.types import MessageMediaDocument, MessageMediaPhoto
 from telethon.errors.rpcerrorlist import UserBlockedError
+from message_collection import (
+    CollectedMessage,
+    new_collection_state,
+    add_collected_message,
+    apply_truncation_flags,
+)
 
 # --- Configuración y Variables de Entorno ---
 API_ID = int(os.getenv("API_ID", "0"))
@@ -150,8 +156,8 @@ def clean_and_extract(raw_text: str):
 def format_nm_response(all_received_messages):
     combined_text = ""
     for msg in all_received_messages:
-        if msg.get("message"):
-            combined_text += msg.get("message", "") + "\n"
+        if msg.message:
+            combined_text += msg.message + "\n"
     combined_text = combined_text.strip()
     if not combined_text:
         return {"status": "success", "message": ""}
@@ -204,7 +210,7 @@ def format_azura_response(all_received_messages):
     """
     parts = []
     for msg in all_received_messages:
-        t = (msg.get("message") or "").strip()
+        t = (msg.message or "").strip()
         if t:
             parts.append(t)
     
@@ -254,6 +260,7 @@ async def send_telegram_command(command: str, consulta_id: str = None, endpoint_
             use_backup = True
 
         all_received_messages = []
+        collection_state = new_collection_state()
         stop_collecting = asyncio.Event()
         last_message_time = [time.time()]
 
@@ -275,13 +282,10 @@ async def send_telegram_command(command: str, consulta_id: str = None, endpoint_
                 else:
                     cleaned = clean_and_extract(raw_text)
 
-                msg_obj = {
-                    "message": cleaned["text"],
-                    "fields": cleaned["fields"],
-                    "urls": [],
-                    "event_message": event.message
-                }
-                all_received_messages.append(msg_obj)
+                msg_obj = CollectedMessage(cleaned["text"], cleaned["fields"], event.message)
+                if not add_collected_message(all_received_messages, collection_state, msg_obj):
+                    stop_collecting.set()
+                    return
 
                 if "ANTI-SPAM" in raw_text and "INTENTA DESPUÉS DE 10 SEGUNDOS" in raw_text:
                     if not use_backup:
@@ -339,13 +343,10 @@ async def send_telegram_command(command: str, consulta_id: str = None, endpoint_
                         else:
                             cleaned = clean_and_extract(raw_text)
 
-                        msg_obj = {
-                            "message": cleaned["text"],
-                            "fields": cleaned["fields"],
-                            "urls": [],
-                            "event_message": event.message
-                        }
-                        all_received_messages.append(msg_obj)
+                        msg_obj = CollectedMessage(cleaned["text"], cleaned["fields"], event.message)
+                        if not add_collected_message(all_received_messages, collection_state, msg_obj):
+                            stop_collecting.set()
+                            return
 
                         if re.search(r"\[⚠️\]\s*no se encontro información", raw_text, re.IGNORECASE):
                             stop_collecting.set()
@@ -375,7 +376,8 @@ async def send_telegram_command(command: str, consulta_id: str = None, endpoint_
             else:
                 raise Exception("No se obtuvo respuesta del bot.")
 
-        return await process_bot_response(client, all_received_messages, command, endpoint_path)
+        result = await process_bot_response(client, all_received_messages, command, endpoint_path)
+        return apply_truncation_flags(result, collection_state)
 
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -384,24 +386,32 @@ async def send_telegram_command(command: str, consulta_id: str = None, endpoint_
             await client.disconnect()
 
 async def process_bot_response(client, all_received_messages, command, endpoint_path):
-    if any("formato correcto" in (m["message"] or "").lower() for m in all_received_messages):
+    try:
+        return await build_bot_response(client, all_received_messages, command, endpoint_path)
+    finally:
+        # Liberar los adjuntos en todas las rutas, incluidas las de error
+        for msg in all_received_messages:
+            msg.release_media()
+
+async def build_bot_response(client, all_received_messages, command, endpoint_path):
+    if any("formato correcto" in (m.message or "").lower() for m in all_received_messages):
         return {"status": "error", "message": "Formato incorrecto."}
 
-    if any(m.get("fields", {}).get("not_found") for m in all_received_messages):
+    if any(m.fields.get("not_found") for m in all_received_messages):
         return {"status": "error", "message": "No se encontraron resultados."}
 
-    # Descargar archivos adjuntos (LederData)
+    # Descargar archivos adjuntos (LederData) y liberar cada media apenas se procesa
     for msg in all_received_messages:
-        event_msg = msg.get("event_message")
-        if event_msg and getattr(event_msg, "media", None):
+        if msg.media:
             try:
-                ext = ".pdf" if "pdf" in str(event_msg.media).lower() else ".jpg"
-                fname = f"{int(time.time())}_{event_msg.id}{ext}"
-                path = await client.download_media(event_msg, file=os.path.join(DOWNLOAD_DIR, fname))
+                fname = f"{int(time.time())}_{msg.media_id}{msg.media_ext}"
+                path = await client.download_media(msg.media, file=os.path.join(DOWNLOAD_DIR, fname))
                 if path:
-                    msg["urls"].append({"url": f"{PUBLIC_URL}/files/{fname}", "type": "document"})
+                    msg.urls.append({"url": f"{PUBLIC_URL}/files/{fname}", "type": "document"})
             except Exception as e:
                 print(f"Error descargando archivo: {e}")
+            finally:
+                msg.release_media()
 
     # Manejo especial para endpoints de nombres
     if endpoint_path in ["/dni_nombres", "/venezolanos_nombres"] or command.startswith(("/nm", "/nmv")):
@@ -410,8 +420,8 @@ async def process_bot_response(client, all_received_messages, command, endpoint_
     # 🆕 Aplicar Parser Universal a la respuesta consolidada de LederData
     combined_text = ""
     for msg in all_received_messages:
-        if msg.get("message"):
-            combined_text += msg.get("message", "") + "\n"
+        if msg.message:
+            combined_text += msg.message + "\n"
     
     combined_text = combined_text.strip()
     
@@ -421,12 +431,12 @@ async def process_bot_response(client, all_received_messages, command, endpoint_
     # Recopilar URLs de archivos
     urls = []
     for msg in all_received_messages:
-        urls.extend(msg.get("urls", []))
+        urls.extend(msg.urls)
     
     # Construir respuesta final con Parser Universal
     final_fields = {}
     for msg in all_received_messages:
-        for k, v in msg.get("fields", {}).items():
+        for k, v in msg.fields.items():
             if v and not final_fields.get(k):
                 final_fields[k] = v
     
@@ -467,6 +477,7 @@ async def send_azura_command(command: str, endpoint_path: str = None):
             raise Exception("Cliente no autorizado.")
 
         all_received_messages = []
+        collection_state = new_collection_state()
         stop_collecting = asyncio.Event()
         last_message_time = [time.time()]
 
@@ -480,11 +491,11 @@ async def send_azura_command(command: str, endpoint_path: str = None):
                 last_message_time[0] = time.time()
                 raw_text = event.raw_text or ""
 
-                all_received_messages.append({
-                    "message": raw_text,
-                    "event_message": event.message
-                })
-                
+                # Azura no descarga adjuntos: solo se conserva el texto
+                if not add_collected_message(all_received_messages, collection_state, CollectedMessage(raw_text)):
+                    stop_collecting.set()
+                    return
+
                 # Marcar que ya recibimos respuesta para detener la espera
                 if raw_text:
                     stop_collecting.set()
@@ -518,7 +529,7 @@ async def send_azura_command(command: str, endpoint_path: str = None):
             return {"status": "error", "message": "No se encontró resultado en la API base"}
 
         # 🆕 Aplicar Parser Universal en la consolidación
-        return format_azura_response(all_received_messages)
+        return apply_truncation_flags(format_azura_response(all_received_messages), collection_state)
 
     except Exception as e:
         return {"status": "error", "message": str(e)}
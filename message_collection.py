@@ -0,0 +1,72 @@
+"""
+Recolección de mensajes con memoria acotada.
+
+Helpers sin dependencia de Telegram/Flask usados por main.py para guardar
+los mensajes recibidos de los bots sin retener los objetos de Telethon.
+"""
+import os
+
+# --- Límites por consulta (mínimo 1 para no descartar todas las respuestas) ---
+MAX_MESSAGES_PER_REQUEST = max(1, int(os.getenv("MAX_MESSAGES_PER_REQUEST", 50)))
+MAX_BYTES_PER_REQUEST = max(1, int(os.getenv("MAX_BYTES_PER_REQUEST", 256 * 1024)))
+
+class CollectedMessage:
+    """
+    Registro compacto de un mensaje recibido. Solo guarda el texto, los campos
+    extraídos y una referencia ligera al adjunto (el objeto media, su id y la
+    extensión), nunca el `event.message` completo de Telethon.
+    """
+    __slots__ = ("message", "fields", "urls", "media", "media_id", "media_ext")
+
+    def __init__(self, message: str, fields: dict = None, event_message=None):
+        self.message = message
+        self.fields = fields or {}
+        self.urls = []
+        media = getattr(event_message, "media", None) if event_message else None
+        self.media = media
+        self.media_id = event_message.id if media else None
+        self.media_ext = (".pdf" if "pdf" in str(media).lower() else ".jpg") if media else None
+
+    def release_media(self):
+        """Libera la referencia al adjunto una vez procesado."""
+        self.media = None
+
+def new_collection_state() -> dict:
+    return {"bytes": 0, "truncated": False, "truncated_reason": None}
+
+def add_collected_message(all_received_messages: list, state: dict, record: CollectedMessage) -> bool:
+    """
+    Agrega un mensaje respetando MAX_MESSAGES_PER_REQUEST y MAX_BYTES_PER_REQUEST.
+    Si se supera el límite de bytes, el texto se recorta. Devuelve False cuando
+    se descartó o recortó un mensaje (hay que dejar de recolectar).
+    """
+    if len(all_received_messages) >= MAX_MESSAGES_PER_REQUEST:
+        state["truncated"] = True
+        state["truncated_reason"] = state["truncated_reason"] or "max_messages"
+        return False
+
+    remaining = MAX_BYTES_PER_REQUEST - state["bytes"]
+    if remaining <= 0:
+        state["truncated"] = True
+        state["truncated_reason"] = state["truncated_reason"] or "max_bytes"
+        return False
+
+    encoded = (record.message or "").encode("utf-8")
+    if len(encoded) > remaining:
+        record.message = encoded[:remaining].decode("utf-8", "ignore")
+        state["bytes"] = MAX_BYTES_PER_REQUEST
+        state["truncated"] = True
+        state["truncated_reason"] = "max_bytes"
+        all_received_messages.append(record)
+        return False
+
+    state["bytes"] += len(encoded)
+    all_received_messages.append(record)
+    return True
+
+def apply_truncation_flags(result: dict, state: dict) -> dict:
+    """Marca la respuesta como truncada si se alcanzó algún límite."""
+    if state["truncated"]:
+        result["truncated"] = True
+        result["truncated_reason"] = state["truncated_reason"]
+    return result
@@ -0,0 +1,137 @@
+import gc
+import tracemalloc
+from types import SimpleNamespace
+
+import pytest
+
+import message_collection
+from message_collection import (
+    CollectedMessage,
+    new_collection_state,
+    add_collected_message,
+    apply_truncation_flags,
+)
+
+
+def fake_event_message(msg_id, media=None, payload_size=4096):
+    """Simula un `event.message` de Telethon con su carga asociada."""
+    return SimpleNamespace(
+        id=msg_id,
+        media=media,
+        raw_text="x" * payload_size,
+        entities=[SimpleNamespace(offset=i, length=1) for i in range(20)],
+        sender=SimpleNamespace(id=1, username="bot", extra=bytearray(payload_size)),
+    )
+
+
+def retained_bytes(build):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        data = build()
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del data
+    return size
+
+
+def test_collected_message_retains_less_memory_than_event_dicts():
+    count = 500
+
+    def old_dicts():
+        return [
+            {"message": "DNI: 12345678", "fields": {}, "urls": [], "event_message": fake_event_message(i)}
+            for i in range(count)
+        ]
+
+    def compact_records():
+        return [CollectedMessage("DNI: 12345678", {}, fake_event_message(i)) for i in range(count)]
+
+    old_size = retained_bytes(old_dicts)
+    new_size = retained_bytes(compact_records)
+    print(f"\nmemoria retenida ({count} mensajes): dicts={old_size} B, CollectedMessage={new_size} B")
+    assert new_size * 10 < old_size
+
+
+def test_collected_message_keeps_light_media_reference():
+    media = SimpleNamespace(mime_type="application/pdf")
+    record = CollectedMessage("texto", {"dni": "12345678"}, fake_event_message(7, media=media))
+    assert record.media is media
+    assert record.media_id == 7
+    assert record.media_ext == ".pdf"
+    assert not hasattr(record, "__dict__")
+
+    record.release_media()
+    assert record.media is None
+
+
+def test_under_caps_has_no_truncated_key(monkeypatch):
+    monkeypatch.setattr(message_collection, "MAX_MESSAGES_PER_REQUEST", 3)
+    monkeypatch.setattr(message_collection, "MAX_BYTES_PER_REQUEST", 100)
+    messages, state = [], new_collection_state()
+
+    for text in ("uno", "dos", "tres"):
+        assert add_collected_message(messages, state, CollectedMessage(text))
+
+    result = apply_truncation_flags({"status": "success"}, state)
+    assert len(messages) == 3
+    assert "truncated" not in result
+
+
+def test_max_messages_flagged_only_when_message_dropped(monkeypatch):
+    monkeypatch.setattr(message_collection, "MAX_MESSAGES_PER_REQUEST", 2)
+    messages, state = [], new_collection_state()
+
+    add_collected_message(messages, state, CollectedMessage("a"))
+    add_collected_message(messages, state, CollectedMessage("b"))
+    assert not state["truncated"]
+
+    assert not add_collected_message(messages, state, CollectedMessage("c"))
+    assert [m.message for m in messages] == ["a", "b"]
+    result = apply_truncation_flags({"status": "success"}, state)
+    assert result["truncated"] is True
+    assert result["truncated_reason"] == "max_messages"
+
+
+def test_max_bytes_cuts_multibyte_text_at_utf8_boundary(monkeypatch):
+    monkeypatch.setattr(message_collection, "MAX_BYTES_PER_REQUEST", 10)
+    messages, state = [], new_collection_state()
+
+    assert add_collected_message(messages, state, CollectedMessage("abc"))
+    assert not add_collected_message(messages, state, CollectedMessage("ñññññ"))
+
+    assert messages[1].message == "ñññ"
+    assert len(messages[1].message.encode("utf-8")) <= 7
+    result = apply_truncation_flags({"status": "success"}, state)
+    assert result["truncated_reason"] == "max_bytes"
+
+    assert not add_collected_message(messages, state, CollectedMessage("d"))
+    assert len(messages) == 2
+
+
+def test_exact_byte_fit_is_not_truncated(monkeypatch):
+    monkeypatch.setattr(message_collection, "MAX_BYTES_PER_REQUEST", 6)
+    messages, state = [], new_collection_state()
+
+    assert add_collected_message(messages, state, CollectedMessage("ñññ"))
+    assert "truncated" not in apply_truncation_flags({}, state)
+
+
+@pytest.mark.parametrize("value", ["0", "-5"])
+def test_caps_are_clamped_to_one(monkeypatch, value):
+    import importlib
+
+    monkeypatch.setenv("MAX_MESSAGES_PER_REQUEST", value)
+    monkeypatch.setenv("MAX_BYTES_PER_REQUEST", value)
+    module = importlib.reload(message_collection)
+    try:
+        assert module.MAX_MESSAGES_PER_REQUEST == 1
+        assert module.MAX_BYTES_PER_REQUEST == 1
+    finally:
+        monkeypatch.delenv("MAX_MESSAGES_PER_REQUEST")
+        monkeypatch.delenv("MAX_BYTES_PER_REQUEST")
+        importlib.reload(message_collection)